@@ -0,0 +1,291 @@
+# alert_dispatcher.py
+# Fan out real-time weather alerts from the MQTT consumer to subscribed users by email
+
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from mailer import is_permanent_failure, send_emails
+
+SUBSCRIBERS_FILE = "subscribers.csv"
+RETRY_QUEUE_FILE = "alert_retry_queue.jsonl"
+
+# Alerts are collected for this long and then sent as one email per subscriber
+COALESCE_WINDOW_SECONDS = float(os.getenv("ALERT_COALESCE_SECONDS", "300"))
+# A condition that persists (same city and alert kind) is emailed again only after this long
+COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "10800"))
+WORKER_COUNT = int(os.getenv("ALERT_WORKERS", "4"))
+BATCH_SIZE = 50  # messages sent over one SMTP session
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60
+
+
+def load_subscriber_index(path: str = SUBSCRIBERS_FILE) -> tuple[dict[str, set[str]], set[str]]:
+    """Build a city -> subscriber emails index from the subscribers file.
+
+    Each row is `email[,city,...]`, as written by the dashboard's subscribe
+    form. Rows without cities subscribe to alerts for every city and are
+    returned separately.
+    """
+    by_city = defaultdict(set)
+    all_cities = set()
+    if not os.path.exists(path):
+        return by_city, all_cities
+
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip():
+                continue
+            email = row[0].strip()
+            cities = [c.strip().lower() for c in row[1:] if c.strip()]
+            if not cities:
+                all_cities.add(email)
+            for city in cities:
+                by_city[city].add(email)
+    return by_city, all_cities
+
+
+def build_alert_email(alerts: dict[str, list[str]]) -> tuple[str, str]:
+    """Return (subject, body) for one subscriber's coalesced alerts."""
+    cities = sorted(alerts)
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
+    if len(cities) <= 3:
+        subject = f"Severe weather alert: {', '.join(cities)}"
+    else:
+        subject = f"Severe weather alerts for {len(cities)} cities"
+
+    lines = [f"Severe weather alerts ({now_str})", ""]
+    for city in cities:
+        lines.append(f"City: {city}")
+        for message in alerts[city]:
+            lines.append(f"  - {message}")
+        lines.append("")
+    return subject, "\n".join(lines)
+
+
+class AlertDispatcher:
+    """Coalesce alerts per subscriber and deliver them on a worker pool.
+
+    `submit()` is cheap and safe to call from the MQTT callback. A background
+    thread flushes every window and emails each (city, alert kind) at most once
+    per cooldown; failed messages are kept in a JSON-lines retry queue on disk
+    so they survive a restart.
+    """
+
+    def __init__(
+        self,
+        subscribers_file: str = SUBSCRIBERS_FILE,
+        retry_file: str = RETRY_QUEUE_FILE,
+        window_seconds: float = COALESCE_WINDOW_SECONDS,
+        workers: int = WORKER_COUNT,
+        cooldown_seconds: float = COOLDOWN_SECONDS,
+    ):
+        self.subscribers_file = subscribers_file
+        self.retry_file = retry_file
+        self.window_seconds = window_seconds
+        self.workers = workers
+        self.cooldown_seconds = cooldown_seconds
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # city -> {alert kind: latest message}
+        self._last_notified = {}  # (city, alert kind) -> time it was last emailed
+        self._index = (defaultdict(set), set())
+        self._index_mtime = None
+        self._retry = self._load_retry_queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def submit(self, city: str, kind: str, message: str):
+        # Repeats of the same alert kind for a city within a window keep only the latest reading
+        with self._lock:
+            self._pending.setdefault(city, {})[kind] = message
+
+    def start(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="alert-mailer")
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+        print(f"Alert dispatcher started (window {self.window_seconds:.0f}s, {self.workers} workers).")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _run(self):
+        while not self._stop.wait(self.window_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error dispatching alerts: {e}")
+        try:
+            self.flush()  # deliver whatever arrived since the last window
+        except Exception as e:
+            print(f"Error dispatching alerts: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            now = time.time()
+            notify = self._outside_cooldown(pending, now)
+            try:
+                fresh = self._build_messages(notify)
+            except Exception:
+                self._restore_pending(pending)
+                raise
+            for city, alerts in notify.items():
+                for kind in alerts:
+                    self._last_notified[(city, kind)] = now
+
+            # One queued email per address: new alerts for an address that already has
+            # a retry pending join that retry and keep its attempt count and backoff
+            queued = {}
+            for message in self._retry:
+                queued[message["to"]] = self._merge(queued.get(message["to"]), message)
+            send_now = []
+            for message in fresh:
+                if message["to"] in queued:
+                    queued[message["to"]] = self._merge(queued[message["to"]], message)
+                else:
+                    send_now.append(message)
+
+            due, waiting = [], []
+            for message in queued.values():
+                (due if message["next_attempt"] <= now else waiting).append(message)
+            outgoing = due + send_now
+            if not outgoing:
+                if fresh:  # new alerts were folded into retries that are not due yet
+                    self._retry = waiting
+                    self._save_retry_queue()
+                return
+
+            batches = [outgoing[i:i + BATCH_SIZE] for i in range(0, len(outgoing), BATCH_SIZE)]
+            if self._pool is not None:
+                results = list(self._pool.map(self._deliver, batches))
+            else:
+                results = [self._deliver(batch) for batch in batches]
+
+            sent = 0
+            for batch, errors in zip(batches, results):
+                for message, error in zip(batch, errors):
+                    if error is None:
+                        sent += 1
+                    elif self._schedule_retry(message, error, now):
+                        waiting.append(message)
+            self._retry = waiting
+            self._save_retry_queue()
+            print(f"Alert dispatch: {sent} sent, {len(outgoing) - sent} failed, {len(self._retry)} queued for retry.")
+
+    def _outside_cooldown(self, pending: dict[str, dict[str, str]], now: float) -> dict[str, dict[str, str]]:
+        # Email a condition when it first shows up, then at most once per cooldown while it lasts
+        notify = {}
+        for city, alerts in pending.items():
+            for kind, message in alerts.items():
+                last = self._last_notified.get((city, kind))
+                if last is None or now - last >= self.cooldown_seconds:
+                    notify.setdefault(city, {})[kind] = message
+        return notify
+
+    def _restore_pending(self, pending: dict[str, dict[str, str]]):
+        # Put undelivered alerts back without overwriting anything newer that arrived meanwhile
+        with self._lock:
+            for city, alerts in pending.items():
+                self._pending[city] = {**alerts, **self._pending.get(city, {})}
+
+    @staticmethod
+    def _merge(older: dict | None, newer: dict) -> dict:
+        """Combine two queued emails to one address; newer city alerts take precedence."""
+        if older is None:
+            return newer
+        return {
+            "to": newer["to"],
+            "alerts": {**older["alerts"], **newer["alerts"]},
+            "attempts": max(older["attempts"], newer["attempts"]),
+            "next_attempt": max(older["next_attempt"], newer["next_attempt"]),
+        }
+
+    def _build_messages(self, pending: dict[str, dict[str, str]]) -> list[dict]:
+        if not pending:
+            return []
+        by_city, all_cities = self._subscriber_index()
+
+        per_subscriber = defaultdict(dict)
+        for city, alerts in pending.items():
+            for email in by_city.get(city.lower(), set()) | all_cities:
+                per_subscriber[email][city] = list(alerts.values())
+
+        return [
+            {"to": email, "alerts": alerts, "attempts": 0, "next_attempt": 0}
+            for email, alerts in per_subscriber.items()
+        ]
+
+    def _subscriber_index(self):
+        # Reload only when the dashboard has added subscribers since the last flush
+        try:
+            mtime = os.path.getmtime(self.subscribers_file)
+        except OSError:
+            mtime = None
+        if mtime != self._index_mtime:
+            self._index = load_subscriber_index(self.subscribers_file)
+            self._index_mtime = mtime
+        return self._index
+
+    @staticmethod
+    def _deliver(batch: list[dict]) -> list:
+        try:
+            return send_emails([(m["to"], *build_alert_email(m["alerts"])) for m in batch])
+        except Exception as e:
+            print(f"Error sending alert batch: {e}")
+            return [e] * len(batch)
+
+    @staticmethod
+    def _schedule_retry(message: dict, error: Exception, now: float) -> bool:
+        """Back off a failed message; return False if it should be dropped instead."""
+        message["attempts"] += 1
+        if is_permanent_failure(error):
+            print(f"Dropping alert email to {message['to']}, refused permanently: {error}")
+            return False
+        if message["attempts"] >= MAX_ATTEMPTS:
+            print(f"Dropping alert email to {message['to']} after {message['attempts']} attempts: {error}")
+            return False
+        message["next_attempt"] = now + RETRY_BASE_SECONDS * 2 ** (message["attempts"] - 1)
+        return True
+
+    def _load_retry_queue(self) -> list[dict]:
+        if not os.path.exists(self.retry_file):
+            return []
+        queue = []
+        with open(self.retry_file, "r", encoding="utf-8", errors="replace") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    message = json.loads(line)
+                    if not message["to"] or not isinstance(message["alerts"], dict):
+                        raise ValueError("missing recipient or alerts")
+                    message.setdefault("attempts", 0)
+                    message.setdefault("next_attempt", 0)
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping unreadable retry entry on line {line_no} of {self.retry_file}: {e}")
+                    continue
+                queue.append(message)
+        return queue
+
+    def _save_retry_queue(self):
+        # Write to a temp file and swap it in so a crash never leaves a half-written queue
+        tmp_file = self.retry_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for message in self._retry:
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, self.retry_file)
@@ -2,6 +2,7 @@
 # Send a daily friendly weather summary by email to all subscribed users
 
 import os
+import csv
 import pandas as pd
 from datetime import datetime
 from mailer import send_email
@@ -38,11 +39,11 @@ def main():
 
     # Load subscribers
     subscribers = []
-    with open(SUBSCRIBERS_FILE, "r", encoding="utf-8") as f:
-        for line in f:
-            email = line.strip()
-            if email:
-                subscribers.append(email)
+    # Rows are `email[,city,...]`; the daily summary covers every city
+    with open(SUBSCRIBERS_FILE, "r", newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                subscribers.append(row[0].strip())
 
     if not subscribers:
         print("Subscribers list is empty, no emails will be sent.")
@@ -30,6 +30,18 @@ email_file = os.path.join(ROOT_DIR, "subscribers.csv")
 
 st.sidebar.subheader("Email Alerts")
 email = st.sidebar.text_input("Enter Email for Daily & Severe Weather Alerts")
+
+# Cities offered for severe alerts: those with readings, else the ones the simulator fetches
+alert_city_options = [c.strip() for c in os.getenv("CITIES", "Cairo").split(",") if c.strip()]
+if os.path.exists(CSV_FILE):
+    try:
+        alert_city_options = sorted(pd.read_csv(CSV_FILE)["city"].dropna().unique())
+    except Exception:
+        pass
+alert_cities = st.sidebar.multiselect(
+    "Severe weather alerts for (leave empty for all cities)",
+    alert_city_options,
+)
 subscribe = st.sidebar.button("Subscribe")
 
 if subscribe and email:
@@ -44,11 +56,14 @@ if subscribe and email:
                         existing.add(row[0].strip())
 
         if email not in existing:
-            # Save new subscriber
+            # Save new subscriber with the cities they want severe alerts for
             with open(email_file, "a", newline="", encoding="utf-8") as f:
                 writer = csv.writer(f)
-                writer.writerow([email])
-            st.sidebar.success("You are subscribed to daily weather summaries!")
+                writer.writerow([email, *alert_cities])
+            alert_scope = ", ".join(alert_cities) if alert_cities else "all cities"
+            st.sidebar.success(
+                f"You are subscribed to daily weather summaries and severe weather alerts for {alert_scope}!"
+            )
 
             # Send immediate welcome email with current city weather
             try:
@@ -87,7 +102,9 @@ if subscribe and email:
                         message_lines.append("🍃 Quite windy—take care if you're heading outside!")
 
                     message_lines.append("")
-                    message_lines.append("You will also receive a daily summary automatically. 👑")
+                    message_lines.append(
+                        f"You will also receive a daily summary and severe weather alerts for {alert_scope} automatically. 👑"
+                    )
 
                     body = "\n".join(message_lines)
                     send_email(
@@ -99,7 +116,7 @@ if subscribe and email:
                     send_email(
                         email,
                         "Welcome to weather updates",
-                        "Hello 👑, you are now subscribed to daily weather summaries.",
+                        f"Hello 👑, you are now subscribed to daily weather summaries and severe weather alerts for {alert_scope}.",
                     )
             except Exception as mail_err:
                 st.sidebar.warning(f"Subscribed, but could not send welcome email: {mail_err}")
@@ -15,16 +15,70 @@ EMAIL_HOST_USER = os.getenv("EMAIL_ADDRESS") or os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_PASSWORD") or os.getenv("EMAIL_HOST_PASSWORD")
 
 
-def send_email(to_email: str, subject: str, body: str):
+def _check_credentials():
     if not EMAIL_HOST_USER or not EMAIL_HOST_PASSWORD:
         raise ValueError("Missing email credentials. Set EMAIL_ADDRESS/EMAIL_PASSWORD in .env")
 
+
+def _build_message(to_email: str, subject: str, body: str) -> MIMEText:
     msg = MIMEText(body, "plain", "utf-8")
     msg["Subject"] = subject
     msg["From"] = EMAIL_HOST_USER
     msg["To"] = to_email
+    return msg
+
+
+def send_email(to_email: str, subject: str, body: str):
+    _check_credentials()
+    msg = _build_message(to_email, subject, body)
 
     with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
         server.starttls()
         server.login(EMAIL_HOST_USER, EMAIL_HOST_PASSWORD)
         server.send_message(msg)
+
+
+def send_emails(messages: list[tuple[str, str, str]]) -> list[Exception | None]:
+    """Send several (to_email, subject, body) messages over a single SMTP session.
+
+    Returns one entry per message: None if it was accepted, otherwise the error.
+    Connection/login failures are raised, since nothing in the batch was sent.
+    If the connection is lost midway, the unsent remainder is marked failed.
+    """
+    _check_credentials()
+    errors = []
+
+    server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
+    try:
+        server.starttls()
+        server.login(EMAIL_HOST_USER, EMAIL_HOST_PASSWORD)
+        for to_email, subject, body in messages:
+            try:
+                server.send_message(_build_message(to_email, subject, body))
+                errors.append(None)
+            except smtplib.SMTPServerDisconnected as e:
+                errors.extend([e] * (len(messages) - len(errors)))
+                break
+            except smtplib.SMTPException as e:
+                # Refused sender/recipient/data: the session is still usable
+                errors.append(e)
+            except OSError as e:
+                # Socket-level failure: the session is gone
+                errors.extend([e] * (len(messages) - len(errors)))
+                break
+    finally:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    return errors
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """True for 5xx refusals of a single message, which resending will not fix."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return error.smtp_code >= 500
+    return False
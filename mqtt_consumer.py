@@ -1,12 +1,25 @@
 import paho.mqtt.client as mqtt
 import json
 import time
+from alert_dispatcher import AlertDispatcher
 
 # --- Configuration ---
 BROKER_HOST = "127.0.0.1"
 BROKER_PORT = 1883
 TOPIC = "weather/readings"  # Must MATCH producer's topic
 
+# Severe conditions are also emailed to subscribers (comfort alerts stay on the console)
+SEVERE_HEAT_C = 40.0
+SEVERE_COLD_C = 0.0
+SEVERE_WIND_MS = 17.0  # gale force
+
+# Emails severe alerts to subscribers, coalesced per time window
+dispatcher = AlertDispatcher()
+
+def raise_severe_alert(city, kind, message):
+    print(message)
+    dispatcher.submit(city, kind, message)
+
 def on_connect(client, userdata, flags, rc, properties=None):
     client.subscribe(TOPIC)
     print(f"Connected to MQTT Broker and subscribed to {TOPIC}!")
@@ -18,6 +31,8 @@ def on_message(client, userdata, msg):
 
         temp = payload.get("temperature_c")
         humidity = payload.get("humidity")
+        wind = payload.get("wind_speed")
+        weather = str(payload.get("weather", "")).lower()
         city = payload.get("city", "UnknownCity") 
 
         if temp is not None and float(temp) < 19.0:
@@ -28,6 +43,17 @@ def on_message(client, userdata, msg):
             print(f"💧 LOW HUMIDITY ALERT! City: {city}, Humidity: {humidity}% (Stay hydrated!)")
         if humidity is not None and float(humidity) > 80.0:
             print(f"🌫️ HIGH HUMIDITY ALERT! City: {city}, Humidity: {humidity}% (It feels muggy!)")
+
+        if temp is not None and float(temp) >= SEVERE_HEAT_C:
+            raise_severe_alert(city, "extreme_heat", f"🥵 EXTREME HEAT ALERT! City: {city}, Temperature: {temp}°C (Stay indoors and drink water!)")
+        if temp is not None and float(temp) <= SEVERE_COLD_C:
+            raise_severe_alert(city, "freezing", f"🧊 FREEZING ALERT! City: {city}, Temperature: {temp}°C (Watch out for ice!)")
+        if wind is not None and float(wind) >= SEVERE_WIND_MS:
+            raise_severe_alert(city, "gale", f"🌪️ GALE WARNING! City: {city}, Wind: {wind} m/s (Avoid going outside if you can!)")
+        if "thunderstorm" in weather:
+            raise_severe_alert(city, "thunderstorm", f"⛈️ THUNDERSTORM ALERT! City: {city}, Weather: {weather} (Stay indoors!)")
+        elif "rain" in weather and ("heavy" in weather or "extreme" in weather):
+            raise_severe_alert(city, "heavy_rain", f"🌧️ HEAVY RAIN ALERT! City: {city}, Weather: {weather} (Expect flooding on the roads!)")
     except Exception as e:
         print(f"Error processing message: {e}")
 
@@ -38,8 +64,10 @@ client.on_message = on_message
 if __name__ == "__main__":
     try:
         print(f"Connecting to {BROKER_HOST}:{BROKER_PORT}, subscribing to '{TOPIC}' ...")
+        dispatcher.start()
         client.connect(BROKER_HOST, BROKER_PORT, 60)
         client.loop_forever()
     except KeyboardInterrupt:
         client.loop_stop()
+        dispatcher.stop()
         print("\n🛑Stopped by user.")
@@ -0,0 +1,308 @@
+# test_alert_dispatcher.py
+# Checks for alert coalescing, subscriber lookup, retries and batched SMTP delivery
+
+import json
+import smtplib
+import time
+
+import pytest
+
+import alert_dispatcher
+import mailer
+from alert_dispatcher import AlertDispatcher, load_subscriber_index
+
+
+class FakeSMTP:
+    """Stand-in for smtplib.SMTP that fails according to `fail_on`."""
+
+    fail_on = {}  # recipient -> exception raised when sending to them
+    fail_login = None
+    sent = []
+
+    def __init__(self, host, port):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        if FakeSMTP.fail_login:
+            raise FakeSMTP.fail_login
+
+    def send_message(self, msg):
+        error = FakeSMTP.fail_on.get(msg["To"])
+        if error:
+            raise error
+        FakeSMTP.sent.append(msg["To"])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSMTP.fail_on = {}
+    FakeSMTP.fail_login = None
+    FakeSMTP.sent = []
+    monkeypatch.setattr(mailer.smtplib, "SMTP", FakeSMTP)
+    monkeypatch.setattr(mailer, "EMAIL_HOST_USER", "bot@example.com")
+    monkeypatch.setattr(mailer, "EMAIL_HOST_PASSWORD", "secret")
+    return FakeSMTP
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """Capture what the dispatcher sends; set `outbox.results` to simulate failures."""
+
+    class Outbox:
+        batches = []
+        results = None
+
+    def fake_send_emails(messages):
+        Outbox.batches.append(messages)
+        if Outbox.results is not None:
+            return Outbox.results(messages)
+        return [None] * len(messages)
+
+    monkeypatch.setattr(alert_dispatcher, "send_emails", fake_send_emails)
+    return Outbox
+
+
+def make_dispatcher(tmp_path, subscribers):
+    subscribers_file = tmp_path / "subscribers.csv"
+    subscribers_file.write_text(subscribers, encoding="utf-8")
+    return AlertDispatcher(
+        subscribers_file=str(subscribers_file),
+        retry_file=str(tmp_path / "retry.jsonl"),
+        window_seconds=60,
+        workers=1,
+    )
+
+
+def sent_messages(outbox):
+    return [message for batch in outbox.batches for message in batch]
+
+
+def test_subscriber_index_with_cities_and_catch_all(tmp_path):
+    path = tmp_path / "subscribers.csv"
+    path.write_text("all@x.com\nb@x.com,Cairo, giza\n\n", encoding="utf-8")
+
+    by_city, all_cities = load_subscriber_index(str(path))
+
+    assert all_cities == {"all@x.com"}
+    assert by_city["cairo"] == {"b@x.com"}
+    assert by_city["giza"] == {"b@x.com"}
+
+
+def test_alerts_coalesce_into_one_email_per_subscriber(tmp_path, outbox):
+    dispatcher = make_dispatcher(tmp_path, "all@x.com\ncairo@x.com,Cairo\n")
+    for i in range(10):
+        dispatcher.submit("Cairo", "low_temp", f"cold {i}")
+    dispatcher.submit("Cairo", "low_humidity", "dry")
+    dispatcher.submit("Giza", "high_temp", "warm")
+
+    dispatcher.flush()
+
+    messages = {to: (subject, body) for to, subject, body in sent_messages(outbox)}
+    assert sorted(messages) == ["all@x.com", "cairo@x.com"]
+    assert len(sent_messages(outbox)) == 2
+
+    subject, body = messages["all@x.com"]
+    assert subject == "Severe weather alert: Cairo, Giza"
+    assert "cold 9" in body and "cold 8" not in body
+    assert "dry" in body and "warm" in body
+
+    subject, body = messages["cairo@x.com"]
+    assert subject == "Severe weather alert: Cairo"
+    assert "warm" not in body
+
+
+def test_persisting_condition_is_emailed_once_per_cooldown(tmp_path, outbox, monkeypatch):
+    dispatcher = make_dispatcher(tmp_path, "a@x.com\n")
+    dispatcher.cooldown_seconds = 3600
+    clock = [0.0]
+    monkeypatch.setattr(alert_dispatcher.time, "time", lambda: clock[0])
+
+    for window in range(24):  # two hours of 5-minute windows
+        clock[0] = window * 300.0
+        dispatcher.submit("Cairo", "extreme_heat", f"hot {window}")
+        if window == 3:
+            dispatcher.submit("Cairo", "gale", "windy")
+        dispatcher.flush()
+
+    bodies = [body for _, _, body in sent_messages(outbox)]
+    assert len(bodies) == 3
+    assert "hot 0" in bodies[0]
+    assert "windy" in bodies[1] and "hot" not in bodies[1]
+    assert "hot 12" in bodies[2] and "windy" not in bodies[2]
+
+
+def test_failed_email_is_retried_with_backoff_and_then_dropped(tmp_path, outbox, monkeypatch):
+    dispatcher = make_dispatcher(tmp_path, "a@x.com\n")
+    outbox.results = lambda messages: [OSError("down")] * len(messages)
+    clock = [1000.0]
+    monkeypatch.setattr(alert_dispatcher.time, "time", lambda: clock[0])
+
+    dispatcher.submit("Cairo", "low_temp", "cold")
+    dispatcher.flush()
+
+    queued = [json.loads(line) for line in open(dispatcher.retry_file, encoding="utf-8")]
+    assert len(queued) == 1
+    assert queued[0]["attempts"] == 1
+    assert queued[0]["next_attempt"] == 1000.0 + alert_dispatcher.RETRY_BASE_SECONDS
+
+    # Not due yet: nothing is sent
+    dispatcher.flush()
+    assert len(outbox.batches) == 1
+
+    for attempt in range(2, alert_dispatcher.MAX_ATTEMPTS + 1):
+        clock[0] = dispatcher._retry[0]["next_attempt"]
+        dispatcher.flush()
+        if attempt < alert_dispatcher.MAX_ATTEMPTS:
+            assert dispatcher._retry[0]["attempts"] == attempt
+            expected = clock[0] + alert_dispatcher.RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+            assert dispatcher._retry[0]["next_attempt"] == expected
+
+    assert dispatcher._retry == []
+    assert open(dispatcher.retry_file, encoding="utf-8").read() == ""
+
+
+def test_new_alerts_join_a_waiting_retry_and_keep_its_backoff(tmp_path, outbox, monkeypatch):
+    dispatcher = make_dispatcher(tmp_path, "a@x.com\n")
+    clock = [1000.0]
+    monkeypatch.setattr(alert_dispatcher.time, "time", lambda: clock[0])
+    dispatcher._retry = [
+        {"to": "a@x.com", "alerts": {"Giza": ["old muggy"], "Cairo": ["old cold"]},
+         "attempts": 2, "next_attempt": 4600.0},
+    ]
+
+    dispatcher.submit("Cairo", "low_temp", "new cold")
+    dispatcher.flush()
+
+    # Not due yet: the new alert waits with the retry instead of going out now
+    assert outbox.batches == []
+    assert len(dispatcher._retry) == 1
+    retry = dispatcher._retry[0]
+    assert retry["attempts"] == 2
+    assert retry["next_attempt"] == 4600.0
+    assert retry["alerts"] == {"Giza": ["old muggy"], "Cairo": ["new cold"]}
+    assert len(open(dispatcher.retry_file, encoding="utf-8").readlines()) == 1
+
+    clock[0] = 4600.0
+    dispatcher.flush()
+
+    messages = sent_messages(outbox)
+    assert len(messages) == 1
+    to, subject, body = messages[0]
+    assert subject == "Severe weather alert: Cairo, Giza"
+    assert "old muggy" in body and "new cold" in body
+    assert "old cold" not in body
+    assert dispatcher._retry == []
+
+
+def test_failing_address_is_dropped_during_an_alert_storm(tmp_path, outbox, monkeypatch, capsys):
+    dispatcher = make_dispatcher(tmp_path, "bad@x.com\n")
+    outbox.results = lambda messages: [OSError("down")] * len(messages)
+    clock = [0.0]
+    monkeypatch.setattr(alert_dispatcher.time, "time", lambda: clock[0])
+
+    attempted_in = []
+    for window in range(6):
+        clock[0] = window * 300.0
+        dispatcher.submit(f"City{window}", "storm", f"storm {window}")
+        before = len(outbox.batches)
+        dispatcher.flush()
+        if len(outbox.batches) > before:
+            attempted_in.append(window)
+
+    # Backoff of 60/120/240/480s skips window 4; the fifth failure drops the email
+    assert attempted_in == [0, 1, 2, 3, 5]
+    assert dispatcher._retry == []
+    assert "Dropping alert email to bad@x.com after 5 attempts" in capsys.readouterr().out
+    to, subject, body = sent_messages(outbox)[-1]
+    assert all(f"storm {window}" in body for window in range(6))
+
+
+def test_permanent_refusal_is_dropped_without_retry(tmp_path, outbox, capsys):
+    dispatcher = make_dispatcher(tmp_path, "gone@x.com\nbusy@x.com\n")
+    refusals = {
+        "gone@x.com": smtplib.SMTPRecipientsRefused({"gone@x.com": (550, b"no such user")}),
+        "busy@x.com": smtplib.SMTPRecipientsRefused({"busy@x.com": (450, b"mailbox busy")}),
+    }
+    outbox.results = lambda messages: [refusals[to] for to, _, _ in messages]
+
+    dispatcher.submit("Cairo", "storm", "storm")
+    dispatcher.flush()
+
+    assert [m["to"] for m in dispatcher._retry] == ["busy@x.com"]
+    assert "Dropping alert email to gone@x.com, refused permanently" in capsys.readouterr().out
+
+
+def test_is_permanent_failure_classifies_smtp_errors():
+    assert mailer.is_permanent_failure(smtplib.SMTPRecipientsRefused({"a@x.com": (550, b"no")}))
+    assert not mailer.is_permanent_failure(smtplib.SMTPRecipientsRefused({"a@x.com": (451, b"later")}))
+    assert mailer.is_permanent_failure(smtplib.SMTPDataError(554, b"rejected"))
+    assert not mailer.is_permanent_failure(smtplib.SMTPDataError(421, b"try again"))
+    assert mailer.is_permanent_failure(smtplib.SMTPSenderRefused(553, b"bad sender", "bot@x.com"))
+    assert not mailer.is_permanent_failure(smtplib.SMTPServerDisconnected("gone"))
+    assert not mailer.is_permanent_failure(TimeoutError("timed out"))
+
+
+def test_flush_error_keeps_pending_alerts_and_retries(tmp_path, outbox):
+    dispatcher = make_dispatcher(tmp_path, "a@x.com\n")
+    retry = {"to": "a@x.com", "alerts": {"Giza": ["muggy"]}, "attempts": 1, "next_attempt": 0}
+    dispatcher._retry = [retry]
+    with open(dispatcher.subscribers_file, "wb") as f:
+        f.write(b"\xff\xfe not utf-8\n")
+
+    dispatcher.submit("Cairo", "low_temp", "cold")
+    with pytest.raises(UnicodeDecodeError):
+        dispatcher.flush()
+
+    assert outbox.batches == []
+    assert dispatcher._pending == {"Cairo": {"low_temp": "cold"}}
+    assert dispatcher._retry == [retry]
+
+
+def test_unreadable_retry_lines_are_skipped(tmp_path):
+    retry_file = tmp_path / "retry.jsonl"
+    retry_file.write_text(
+        '{"to": "a@x.com", "alerts": {"Cairo": ["cold"]}, "attempts": 2, "next_attempt": 5}\n'
+        "not json\n"
+        '{"to": "b@x.com"}\n',
+        encoding="utf-8",
+    )
+
+    dispatcher = AlertDispatcher(subscribers_file=str(tmp_path / "none.csv"), retry_file=str(retry_file))
+
+    assert [m["to"] for m in dispatcher._retry] == ["a@x.com"]
+
+
+def test_send_emails_reports_refused_recipient_per_message(fake_smtp):
+    fake_smtp.fail_on = {"b@x.com": smtplib.SMTPRecipientsRefused({"b@x.com": (550, b"no")})}
+
+    errors = mailer.send_emails([("a@x.com", "s", "b"), ("b@x.com", "s", "b"), ("c@x.com", "s", "b")])
+
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], smtplib.SMTPRecipientsRefused)
+    assert fake_smtp.sent == ["a@x.com", "c@x.com"]
+
+
+def test_send_emails_marks_only_unsent_remainder_when_connection_drops(fake_smtp):
+    fake_smtp.fail_on = {"c@x.com": TimeoutError("timed out")}
+
+    errors = mailer.send_emails([(to, "s", "b") for to in ["a@x.com", "b@x.com", "c@x.com", "d@x.com"]])
+
+    assert errors[:2] == [None, None]
+    assert all(isinstance(e, TimeoutError) for e in errors[2:])
+    assert fake_smtp.sent == ["a@x.com", "b@x.com"]
+
+
+def test_send_emails_raises_when_login_fails(fake_smtp):
+    fake_smtp.fail_login = smtplib.SMTPAuthenticationError(535, b"bad credentials")
+
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        mailer.send_emails([("a@x.com", "s", "b")])